@@ -225,6 +225,13 @@ export async function POST(req: Request) {
             updatedAt: FieldValue.serverTimestamp()
         });
 
+        // Image ZIPs get TFRecord conversion (step 5.5); its initial status is
+        // written with the project update below rather than as a separate write
+        const isImageDataset = schema.inferredTaskType === 'image_classification' ||
+            (schema.imageStats && schema.imageStats.totalImages > 0) ||
+            gcsPath.toLowerCase().endsWith('.zip');
+        const needsTFRecordConversion = isImageDataset && gcsPath.toLowerCase().endsWith('.zip');
+
         // 5. Update project with taskType, versionId for lineage, and dataset info
         await adminDb.collection('projects').doc(projectId).update({
             // Schema detection fields
@@ -254,23 +261,18 @@ export async function POST(req: Request) {
             'dataset.rowCount': schema.rowCount || 0,
             'dataset.storageUrl': gcsPath,  // Critical: This is needed for training!
             'dataset.gcsPath': gcsPath,     // Also store as gcsPath for compatibility
-            'dataset.fileSize': fileSize || 0
+            'dataset.fileSize': fileSize || 0,
+            // Conversion status for image datasets (triggered in 5.5)
+            ...(needsTFRecordConversion ? {
+                'dataset.conversionStatus': 'pending',
+                'dataset.conversionProgress': 0
+            } : {})
         });
 
         // 5.5. Trigger TFRecord conversion for image datasets (async, non-blocking)
-        const isImageDataset = schema.inferredTaskType === 'image_classification' ||
-            (schema.imageStats && schema.imageStats.totalImages > 0) ||
-            gcsPath.toLowerCase().endsWith('.zip');
-
-        if (isImageDataset && gcsPath.toLowerCase().endsWith('.zip')) {
+        if (needsTFRecordConversion) {
             console.log(`[Upload Confirm] 🔄 Triggering TFRecord conversion for image dataset`);
 
-            // Update project with conversion status
-            await adminDb.collection('projects').doc(projectId).update({
-                'dataset.conversionStatus': 'pending',
-                'dataset.conversionProgress': 0
-            });
-
             // Trigger Cloud Function asynchronously (don't await)
             const cloudFunctionUrl = process.env.TFRECORD_CONVERTER_URL;
             if (cloudFunctionUrl) {
@@ -290,7 +292,8 @@ export async function POST(req: Request) {
                         datasetPath: filePath,
                         bucket: bucketName,
                         shardSizeMB: 50,
-                        valSplit: 0.2
+                        valSplit: 0.2,
+                        includeFilenames: false  // Per-record file names are opt-in
                     })
                 }).then(res => {
                     console.log(`[Upload Confirm] TFRecord conversion triggered: ${res.status}`);
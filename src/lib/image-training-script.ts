@@ -249,6 +249,9 @@ def load_tfrecord_dataset(shards_dir, batch_size=32, image_size=(128, 128)):
     
     num_classes = metadata['numClasses']
     class_names = metadata['classNames']
+    # Shards written before compression support have no 'compression' field
+    compression = metadata.get('compression', 'NONE')
+    compression_type = '' if compression == 'NONE' else compression
     
     # Get shard file paths
     train_shards = [os.path.join(shards_dir, p) for p in metadata['shardPaths']['train']]
@@ -258,6 +261,7 @@ def load_tfrecord_dataset(shards_dir, batch_size=32, image_size=(128, 128)):
     print(f"  Training shards: {len(train_shards)}")
     print(f"  Validation shards: {len(val_shards)}")
     print(f"  Classes: {num_classes}")
+    print(f"  Compression: {compression}")
     
     def parse_example(serialized):
         features = tf.io.parse_single_example(serialized, {
@@ -273,7 +277,11 @@ def load_tfrecord_dataset(shards_dir, batch_size=32, image_size=(128, 128)):
         return image, label
     
     # Create training dataset
-    train_dataset = tf.data.TFRecordDataset(train_shards)
+    train_dataset = tf.data.TFRecordDataset(train_shards, compression_type=compression_type)
+    # Converters that write shardIndex record exact sample counts
+    has_exact_counts = 'shardIndex' in metadata
+    if has_exact_counts:
+        train_dataset = train_dataset.apply(tf.data.experimental.assert_cardinality(metadata['trainSamples']))
     train_dataset = train_dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE)
     train_dataset = train_dataset.shuffle(10000)
     train_dataset = train_dataset.batch(batch_size)
@@ -281,7 +289,9 @@ def load_tfrecord_dataset(shards_dir, batch_size=32, image_size=(128, 128)):
     
     # Create validation dataset
     if val_shards:
-        val_dataset = tf.data.TFRecordDataset(val_shards)
+        val_dataset = tf.data.TFRecordDataset(val_shards, compression_type=compression_type)
+        if has_exact_counts and metadata.get('valSamples'):
+            val_dataset = val_dataset.apply(tf.data.experimental.assert_cardinality(metadata['valSamples']))
         val_dataset = val_dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE)
         val_dataset = val_dataset.batch(batch_size)
         val_dataset = val_dataset.prefetch(tf.data.AUTOTUNE)
@@ -2,12 +2,33 @@
  * TFRecord Converter - Generates Python script for converting image folders to TFRecord shards
  * 
  * Features:
+ * - Reads images straight from a ZIP archive (no extraction) or an image folder
+ * - Streams gs:// archives with ranged reads instead of downloading them first
+ * - Inflates ZIP members with zlib-ng when it is installed
+ * - Prefetches image bytes on a thread pool while shards are written
+ * - Writes shard groups in parallel worker processes
+ * - Writes shards straight to GCS when outputDir is a gs:// URI (no tmpfs staging)
+ * - Or, for a local outputDir, optionally uploads shards to gcsOutputUri while
+ *   the remaining shards are written
  * - Handles train/val/test splits
- * - Creates ~50MB shards for optimal GPU loading
+ * - Sizes shards from the dataset (at least 8 shards, none much above 100MB)
+ *   unless shardSizeMB is given
+ * - GZIP-compresses shards by default (recorded in metadata for readers)
  * - Stores metadata with class names, counts, dimensions
- * - Adds MD5 checksums for integrity verification
+ * - Writes a <split>.index per split with per-shard record counts, record bytes and file sizes
+ * - Adds shard checksums for integrity verification (SHA-256 locally, GCS MD5 for gs://)
  */
 
+export type TFRecordCompression = 'GZIP' | 'ZLIB' | 'NONE';
+
+/** One entry of a <split>.index file */
+export interface TFRecordShardIndexEntry {
+    shard: string;
+    count: number;  // Records in the shard
+    recordBytes: number;  // Serialized record bytes, before compression
+    fileBytes: number;  // Shard file size on disk (after compression)
+}
+
 export interface TFRecordMetadata {
     numClasses: number;
     classNames: string[];
@@ -16,22 +37,38 @@ export interface TFRecordMetadata {
     testSamples?: number;
     originalWidth?: number;
     originalHeight?: number;
+    shardSizeBytes?: number;
     shardPaths: {
         train: string[];
         val?: string[];
         test?: string[];
     };
+    shardIndex?: {
+        train: string;
+        val?: string;
+        test?: string;
+    };
     checksums: Record<string, string>;
+    checksumAlgorithm?: 'sha256' | 'md5';  // Absent means md5 (older metadata)
+    compression?: TFRecordCompression;  // Absent in metadata written before compression support
+    includeFilenames?: boolean;  // Absent means true (older shards always stored 'filename')
     createdAt: string;
 }
 
 export function generateTFRecordConverterScript(config: {
     inputDir: string;
     outputDir: string;
+    inputZip?: string;
+    gcsOutputUri?: string;
     shardSizeMB?: number;
     valSplit?: number;
+    compression?: TFRecordCompression;
+    includeFilenames?: boolean;
 }): string {
-    const { inputDir, outputDir, shardSizeMB = 50, valSplit = 0.2 } = config;
+    const {
+        inputDir, outputDir, inputZip = '', gcsOutputUri = '', shardSizeMB, valSplit = 0.2,
+        compression = 'GZIP', includeFilenames = false
+    } = config;
 
     return `#!/usr/bin/env python3
 """
@@ -42,152 +79,528 @@ Converts image folder dataset to TFRecord shards for fast training.
 import tensorflow as tf
 import os
 import json
+import base64
 import hashlib
+import itertools
+import multiprocessing
+import multiprocessing.util
 import random
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
+import imagesize
 import io
 
+# zipfile looks up zlib and crc32 at call time, so swapping in zlib-ng's
+# SIMD-accelerated inflate/CRC32 speeds up every member read
+try:
+    from zlib_ng import zlib_ng
+    zipfile.zlib = zlib_ng
+    zipfile.crc32 = zlib_ng.crc32
+except ImportError:
+    pass
+
 # Configuration
 INPUT_DIR = "${inputDir}"
-OUTPUT_DIR = "${outputDir}"
-SHARD_SIZE_MB = ${shardSizeMB}
+INPUT_ZIP = "${inputZip}"  # When set (local path or gs://), images are read straight from this archive
+OUTPUT_DIR = "${outputDir}"  # Local path or gs://bucket/prefix (written via tf.io.gfile)
+GCS_OUTPUT_URI = "${gcsOutputUri}"  # When set (gs://bucket/prefix), local shards are also uploaded here
+SHARD_SIZE_MB = ${shardSizeMB ?? 'None'}  # None: derive from the dataset size
+# Auto sizing: split evenly into at least MIN_AUTO_SHARDS shards of at most ~TARGET_SHARD_SIZE
+TARGET_SHARD_SIZE = 100 * 1024 * 1024
+MIN_AUTO_SHARDS = 8
 VAL_SPLIT = ${valSplit}
+COMPRESSION = "${compression}"  # GZIP, ZLIB or NONE; readers must pass the same compression_type
+# GCS already stores an MD5 for every object it receives; local shards get SHA-256
+CHECKSUM_ALGORITHM = 'md5' if OUTPUT_DIR.startswith('gs://') else 'sha256'
+# Store each image's file name in a 'filename' feature (debugging only; costs bytes per record)
+INCLUDE_FILENAMES = ${includeFilenames ? 'True' : 'False'}
+
+IMAGE_RE = re.compile(r'\\.(?:png|jpe?g|webp|gif|bmp)$', re.IGNORECASE)
+SKIP_DIRS = ('__pycache__', '.git', '__MACOSX')
+# Splits a ZIP member path into (root, class folder, file name)
+ZIP_MEMBER_RE = re.compile(r'^(?:(.*)/)?([^/]+)/([^/]+)$')
+# Threads reading image bytes ahead of the shard writer (inflate and file I/O release the GIL)
+READ_WORKERS = (os.cpu_count() or 1) * 2
+# Processes writing shard groups in parallel (proto serialization is CPU-bound)
+SHARD_WORKERS = os.cpu_count() or 1
+# Read threads in each shard worker process, so all workers together use about READ_WORKERS
+WORKER_READ_WORKERS = max(2, READ_WORKERS // SHARD_WORKERS)
+# Least image data worth one more worker process; each spawned worker re-imports TensorFlow
+MIN_WORKER_BYTES = 100 * 1024 * 1024
+# Threads uploading finished shards to GCS_OUTPUT_URI (HTTP I/O releases the GIL)
+UPLOAD_WORKERS = 16
+# Shards above this size are sent as concurrent multipart chunks
+PARALLEL_UPLOAD_THRESHOLD = 32 * 1024 * 1024
+PARALLEL_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-def _bytes_feature(value):
-    """Returns a bytes_list from a string / byte."""
-    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+# Read-ahead size for gs:// archives; small because members are read in shuffled order
+GCS_READ_CHUNK_SIZE = 1024 * 1024
 
-def _int64_feature(value):
-    """Returns an int64_list from a bool / enum / int / uint."""
-    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+_thread_state = threading.local()
+# Image size in bytes by path, recorded while indexing so sizing never stats again
+IMAGE_SIZES = {}
+# Every per-thread ZipFile handle opened in this process, so they can be closed at the end
+_zip_handles = []
+_zip_handles_lock = threading.Lock()
+# Process-wide pools, created on first use and reused by every split
+_read_pool = None
+_shard_pool = None
+
+# Prototype reused for every record; only the shard writer thread serializes
+# examples. The value containers are bound once so each record skips the
+# features map lookups and just overwrites element 0.
+_EXAMPLE = tf.train.Example(features=tf.train.Features(feature={
+    'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[b''])),
+    'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[0])),
+}))
+if INCLUDE_FILENAMES:
+    _EXAMPLE.features.feature['filename'].bytes_list.value.append(b'')
+_IMAGE_VALUE = _EXAMPLE.features.feature['image'].bytes_list.value
+_LABEL_VALUE = _EXAMPLE.features.feature['label'].int64_list.value
+_FILENAME_VALUE = _EXAMPLE.features.feature['filename'].bytes_list.value if INCLUDE_FILENAMES else None
 
 def find_image_folder(base_path, max_depth=4):
-    """Find the folder containing train/class structure"""
+    """Find the folder containing train/class structure.
+    
+    Single top-down os.walk; skipped folders are pruned from dirnames in
+    place so the walk never descends into them.
+    """
     def get_subdirs(path):
         if not os.path.exists(path):
             return []
-        return [d for d in os.listdir(path) 
-                if os.path.isdir(os.path.join(path, d)) 
-                and d not in ['__pycache__', '.git', '__MACOSX']]
+        with os.scandir(path) as entries:
+            return [e.name for e in entries if e.is_dir() and e.name not in SKIP_DIRS]
     
     def has_images(folder):
         try:
-            files = os.listdir(folder)[:20]
-            return any(f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')) for f in files)
+            with os.scandir(folder) as entries:
+                files = [e.name for e in itertools.islice(entries, 20)]
+            return any(IMAGE_RE.search(f) for f in files)
         except:
             return False
     
-    def search(path, depth=0):
-        if depth > max_depth:
-            return None
-        
-        subdirs = get_subdirs(path)
-        subdir_lower = {d.lower(): d for d in subdirs}
+    base_depth = base_path.rstrip(os.sep).count(os.sep)
+    for dirpath, dirnames, _ in os.walk(base_path):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        subdir_lower = {d.lower(): d for d in dirnames}
         
         # Check for train folder
         for name in ['train', 'training']:
             if name in subdir_lower:
-                train_dir = os.path.join(path, subdir_lower[name])
+                train_dir = os.path.join(dirpath, subdir_lower[name])
                 train_subdirs = get_subdirs(train_dir)
                 if train_subdirs and has_images(os.path.join(train_dir, train_subdirs[0])):
                     test_dir = None
                     for t in ['test', 'val', 'validation']:
                         if t in subdir_lower:
-                            test_dir = os.path.join(path, subdir_lower[t])
+                            test_dir = os.path.join(dirpath, subdir_lower[t])
                             break
                     return {'train': train_dir, 'test': test_dir}
         
         # Check for direct class folders
-        if len(subdirs) > 1:
-            first_class = os.path.join(path, subdirs[0])
-            if has_images(first_class):
-                return {'train': path, 'test': None}
-        
-        # Recurse
-        for subdir in subdirs:
-            result = search(os.path.join(path, subdir), depth + 1)
-            if result:
-                return result
+        if len(dirnames) > 1 and has_images(os.path.join(dirpath, dirnames[0])):
+            return {'train': dirpath, 'test': None}
         
-        return None
+        # Look at this level but do not descend past max_depth
+        if dirpath.rstrip(os.sep).count(os.sep) - base_depth >= max_depth:
+            dirnames[:] = []
     
-    return search(base_path)
+    return None
 
-def collect_images(class_dir, class_idx):
-    """Collect all image paths from a class directory"""
+def collect_images(class_dir):
+    """Collect all image paths from a class directory, recording their sizes"""
     images = []
-    extensions = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
-    
-    for img_file in os.listdir(class_dir):
-        if img_file.lower().endswith(extensions):
-            img_path = os.path.join(class_dir, img_file)
-            images.append((img_path, class_idx))
-    
+    with os.scandir(class_dir) as entries:
+        for e in entries:
+            if e.is_file() and IMAGE_RE.search(e.name):
+                IMAGE_SIZES[e.path] = e.stat().st_size
+                images.append(e.path)
     return images
 
+def index_folder_images(folders):
+    """Group image paths by split and class for an extracted dataset"""
+    def index_split(split_dir):
+        with os.scandir(split_dir) as entries:
+            return {e.name: collect_images(e.path) for e in entries
+                    if e.is_dir() and e.name not in SKIP_DIRS}
+    
+    return {
+        'train': index_split(folders['train']),
+        'test': index_split(folders['test']) if folders.get('test') else None,
+    }
+
+def index_zip_images(zf):
+    """Group ZIP member names by split and class in a single pass over the
+    central directory, so images can be read without extracting the archive."""
+    roots = {}
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        match = ZIP_MEMBER_RE.match(info.filename)
+        if not match or not IMAGE_RE.search(match.group(3)):
+            continue
+        root, class_name = match.group(1) or '', match.group(2)
+        if any(part in SKIP_DIRS for part in root.split('/')) or class_name in SKIP_DIRS:
+            continue
+        roots.setdefault(root, {}).setdefault(class_name, []).append(info.filename)
+        IMAGE_SIZES[info.filename] = info.file_size
+    
+    def parent_of(root):
+        return root.rsplit('/', 1)[0] if '/' in root else ''
+    
+    def name_of(root):
+        return root.rsplit('/', 1)[-1].lower()
+    
+    ordered = sorted(roots, key=lambda r: (r.count('/'), r))
+    
+    # Prefer the shallowest train/ (or training/) folder, then direct class folders
+    for root in ordered:
+        if name_of(root) in ('train', 'training'):
+            siblings = {name_of(r): r for r in roots if r != root and parent_of(r) == parent_of(root)}
+            test = next((siblings[t] for t in ['test', 'val', 'validation'] if t in siblings), None)
+            return {'train': roots[root], 'test': roots[test] if test is not None else None}
+    
+    for root in ordered:
+        if len(roots[root]) > 1:
+            return {'train': roots[root], 'test': None}
+    
+    return None
+
+_storage_client = None
+
+def get_storage_client():
+    """Shared google-cloud-storage client, created on first use"""
+    global _storage_client
+    if _storage_client is None:
+        from google.cloud import storage
+        _storage_client = storage.Client()
+    return _storage_client
+
+def open_input_zip():
+    """Open INPUT_ZIP. gs:// archives are opened through a seekable blob reader,
+    so only the central directory and the members actually read are fetched."""
+    if INPUT_ZIP.startswith('gs://'):
+        bucket_name, _, blob_name = INPUT_ZIP[len('gs://'):].partition('/')
+        blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+        return zipfile.ZipFile(blob.open('rb', chunk_size=GCS_READ_CHUNK_SIZE))
+    return zipfile.ZipFile(INPUT_ZIP)
+
+def close_zip(zf):
+    """Close a ZipFile and the gs:// blob reader under it (ZipFile.close()
+    leaves file objects it was handed open)"""
+    fp = zf.fp
+    zf.close()
+    if fp is not None:
+        fp.close()
+
+def _zip_handle():
+    """Per-thread ZipFile handle; ZipFile is not safe for concurrent reads"""
+    zf = getattr(_thread_state, 'zf', None)
+    if zf is None:
+        zf = _thread_state.zf = open_input_zip()
+        with _zip_handles_lock:
+            _zip_handles.append(zf)
+    return zf
+
+def get_read_pool(workers=READ_WORKERS):
+    """Thread pool for image reads, shared across splits so each thread keeps
+    its ZipFile handle (and, for gs://, its parsed central directory)"""
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = ThreadPoolExecutor(max_workers=workers)
+    return _read_pool
+
+def close_readers():
+    """Shut down the read pool and close every ZipFile handle this process opened"""
+    global _read_pool
+    if _read_pool is not None:
+        _read_pool.shutdown()
+        _read_pool = None
+    with _zip_handles_lock:
+        handles = _zip_handles[:]
+        _zip_handles.clear()
+    for zf in handles:
+        close_zip(zf)
+    _thread_state.__dict__.pop('zf', None)
+
+def read_image_bytes(img_path):
+    """Read raw image bytes from INPUT_ZIP or disk"""
+    if INPUT_ZIP:
+        return _zip_handle().read(img_path)
+    
+    return Path(img_path).read_bytes()
+
+def tfrecord_options():
+    """TFRecordOptions for COMPRESSION (TensorFlow spells 'no compression' as '')"""
+    return tf.io.TFRecordOptions(compression_type='' if COMPRESSION == 'NONE' else COMPRESSION)
+
+def image_size(img_path):
+    """Size in bytes of an image, as recorded by the folder or ZIP index"""
+    return IMAGE_SIZES[img_path]
+
+def prefetch_images(images, workers=READ_WORKERS):
+    """Yield (img_path, label, future_bytes) in order, keeping a bounded
+    number of reads in flight so memory stays flat on large datasets."""
+    window = workers * 4
+    pool = get_read_pool(workers)
+    pending = deque()
+    for img_path, label in images:
+        pending.append((img_path, label, pool.submit(read_image_bytes, img_path)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
 def get_image_dimensions(img_path):
-    """Get original image dimensions"""
+    """Get original image dimensions by parsing only the file header"""
     try:
-        with Image.open(img_path) as img:
+        data = read_image_bytes(img_path) if INPUT_ZIP else None
+        width, height = imagesize.get(io.BytesIO(data) if INPUT_ZIP else img_path)
+        if width > 0 and height > 0:
+            return (width, height)
+        
+        # imagesize returns (-1, -1) for headers it cannot parse. It also closes
+        # the stream it was given (1.4.x), so Pillow gets a fresh one
+        with Image.open(io.BytesIO(data) if INPUT_ZIP else img_path) as img:
             return img.size  # (width, height)
     except:
         return (0, 0)
 
-def create_example(img_path, label):
-    """Create a TFRecord example from an image"""
-    with open(img_path, 'rb') as f:
-        img_bytes = f.read()
-    
-    example = tf.train.Example(features=tf.train.Features(feature={
-        'image': _bytes_feature(img_bytes),
-        'label': _int64_feature(label),
-        'filename': _bytes_feature(os.path.basename(img_path).encode()),
-    }))
-    
-    return example.SerializeToString()
+def create_example(img_bytes, img_path, label):
+    """Serialize a TFRecord example from raw image bytes.
+    
+    Overwrites the fields of the shared _EXAMPLE prototype instead of building
+    a new Example (and its Features/Feature wrappers) for every image.
+    """
+    _IMAGE_VALUE[0] = img_bytes
+    _LABEL_VALUE[0] = label
+    if INCLUDE_FILENAMES:
+        _FILENAME_VALUE[0] = os.path.basename(img_path).encode()
+    
+    return _EXAMPLE.SerializeToString()
 
-def write_shards(images, output_prefix, shard_size_bytes):
-    """Write images to TFRecord shards"""
-    shard_paths = []
-    checksums = {}
+def file_checksum(path, chunk_size=1 << 20):
+    """CHECKSUM_ALGORITHM hex digest of a file, without reading it whole.
+    
+    Local files go through hashlib.file_digest (Python 3.11+), which hashes
+    via a reusable buffer on OpenSSL's SHA-NI code path where the CPU has it.
+    """
+    if not path.startswith('gs://') and hasattr(hashlib, 'file_digest'):
+        with open(path, 'rb') as f:
+            return hashlib.file_digest(f, CHECKSUM_ALGORITHM).hexdigest()
+    
+    h = hashlib.new(CHECKSUM_ALGORITHM)
+    with tf.io.gfile.GFile(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def shard_checksum(path):
+    """Checksum of a finished shard. GCS computes the MD5 of gs:// objects on
+    upload, so it is read from the object metadata rather than downloading."""
+    if path.startswith('gs://'):
+        bucket_name, _, blob_name = path[len('gs://'):].partition('/')
+        blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+        if blob is not None and blob.md5_hash:
+            return base64.b64decode(blob.md5_hash).hex()
+    return file_checksum(path)
+
+def pick_shard_size(images):
+    """Shard size in bytes: SHARD_SIZE_MB when configured, otherwise the total
+    split evenly into max(MIN_AUTO_SHARDS, total / TARGET_SHARD_SIZE) shards,
+    so small datasets still get several shards and large ones stay near 100MB"""
+    if SHARD_SIZE_MB is not None:
+        shard_size_bytes = int(SHARD_SIZE_MB * 1024 * 1024)
+        if shard_size_bytes <= 0:
+            raise ValueError(f"SHARD_SIZE_MB must be positive, got {SHARD_SIZE_MB}")
+        return shard_size_bytes
+    total_bytes = sum(image_size(img_path) for img_path, _ in images)
+    num_shards = max(MIN_AUTO_SHARDS, -(-total_bytes // TARGET_SHARD_SIZE))
+    # Never plan more shards than images
+    num_shards = max(1, min(num_shards, len(images)))
+    return max(1, -(-total_bytes // num_shards))
+
+def partition_images(images, shard_size_bytes, workers=SHARD_WORKERS):
+    """Split images into contiguous chunks, one per worker, so every worker
+    fills roughly whole shards. Each chunk also gets at least MIN_WORKER_BYTES,
+    so small datasets stay in-process whatever shard size was picked."""
+    total_bytes = sum(image_size(img_path) for img_path, _ in images)
+    bytes_per_chunk = max(shard_size_bytes, MIN_WORKER_BYTES)
+    num_chunks = max(1, min(workers, total_bytes // bytes_per_chunk, len(images)))
+    chunk_len = max(1, -(-len(images) // num_chunks))
+    return [images[i:i + chunk_len] for i in range(0, len(images), chunk_len)] or [images]
+
+def write_shard_range(job, on_shard=None):
+    """Write one chunk of images to its own group of shards.
+    
+    Runs inside a worker process and returns
+    [(shard_path, checksum, record_count, record_bytes, file_bytes), ...].
+    on_shard, if given, is called with each shard path as soon as it is closed.
+    """
+    images, output_prefix, shard_size_bytes, read_workers = job
+    shards = []
     
     shard_idx = 0
     current_size = 0
+    current_count = 0
     writer = None
     current_shard_path = None
-    hasher = None
     
-    for img_path, label in images:
+    for img_path, label, img_bytes in prefetch_images(images, read_workers):
         # Start new shard if needed
         if writer is None or current_size >= shard_size_bytes:
             if writer:
                 writer.close()
                 # Compute checksum for completed shard
-                with open(current_shard_path, 'rb') as f:
-                    checksums[os.path.basename(current_shard_path)] = hashlib.md5(f.read()).hexdigest()
+                shards.append((current_shard_path, shard_checksum(current_shard_path),
+                               current_count, current_size,
+                               tf.io.gfile.stat(current_shard_path).length))
+                if on_shard:
+                    on_shard(current_shard_path)
             
             current_shard_path = f"{output_prefix}-{shard_idx:05d}.tfrecord"
-            shard_paths.append(os.path.basename(current_shard_path))
-            writer = tf.io.TFRecordWriter(current_shard_path)
+            writer = tf.io.TFRecordWriter(current_shard_path, options=tfrecord_options())
             shard_idx += 1
             current_size = 0
+            current_count = 0
             print(f"  Writing shard: {current_shard_path}")
         
         try:
-            serialized = create_example(img_path, label)
+            serialized = create_example(img_bytes.result(), img_path, label)
             writer.write(serialized)
             current_size += len(serialized)
+            current_count += 1
         except Exception as e:
             print(f"  Warning: Failed to process {img_path}: {e}")
     
     # Close final shard
     if writer:
         writer.close()
-        with open(current_shard_path, 'rb') as f:
-            checksums[os.path.basename(current_shard_path)] = hashlib.md5(f.read()).hexdigest()
+        shards.append((current_shard_path, shard_checksum(current_shard_path),
+                       current_count, current_size,
+                       tf.io.gfile.stat(current_shard_path).length))
+        if on_shard:
+            on_shard(current_shard_path)
     
-    return shard_paths, checksums
+    return shards
+
+def _init_shard_worker():
+    # Runs close_readers when the worker exits after Pool.close(); terminate() would skip it
+    multiprocessing.util.Finalize(None, close_readers, exitpriority=10)
+
+def get_shard_pool():
+    """Shard worker processes, started once and reused by every split so each
+    worker keeps its read pool and ZipFile handles"""
+    global _shard_pool
+    if _shard_pool is None:
+        # spawn, not fork: forking after TensorFlow has started its threads can deadlock
+        _shard_pool = multiprocessing.get_context('spawn').Pool(
+            SHARD_WORKERS, initializer=_init_shard_worker)
+    return _shard_pool
+
+def close_shard_pool():
+    """Let the shard workers exit cleanly (closing their readers) and wait for them"""
+    global _shard_pool
+    if _shard_pool is not None:
+        _shard_pool.close()
+        _shard_pool.join()
+        _shard_pool = None
+
+def write_shards(images, output_prefix, shard_size_bytes, on_shard=None):
+    """Write images to TFRecord shards, one contiguous chunk per worker process.
+    
+    on_shard, if given, is called with every finished shard path as soon as
+    its final name is known. Returns
+    (shard_paths, checksums, counts_per_shard, record_bytes_per_shard,
+    file_bytes_per_shard).
+    """
+    chunks = partition_images(images, shard_size_bytes)
+    if len(chunks) == 1:
+        # Final names are known up front, so shards are handed off as they close
+        job = (chunks[0], output_prefix, shard_size_bytes, READ_WORKERS)
+        results = [write_shard_range(job, on_shard)]
+        on_rename = None
+    else:
+        jobs = [(chunk, f"{output_prefix}-part{i:03d}", shard_size_bytes, WORKER_READ_WORKERS)
+                for i, chunk in enumerate(chunks)]
+        # imap yields chunks in order as they finish, so early shards go out first
+        results = get_shard_pool().imap(write_shard_range, jobs)
+        on_rename = on_shard
+    
+    # Rename worker shards to contiguous indices locally. On GCS a rename is a
+    # copy plus a delete, so gs:// shards keep their per-worker names; readers
+    # take the names from shardPaths rather than a glob
+    rename = not output_prefix.startswith('gs://')
+    shard_paths = []
+    checksums = {}
+    counts = []
+    sizes = []
+    file_sizes = []
+    for shard_path, checksum, count, size, file_size in (shard for result in results for shard in result):
+        final_path = f"{output_prefix}-{len(shard_paths):05d}.tfrecord" if rename else shard_path
+        if shard_path != final_path:
+            tf.io.gfile.rename(shard_path, final_path, overwrite=True)
+        shard_paths.append(os.path.basename(final_path))
+        checksums[os.path.basename(final_path)] = checksum
+        counts.append(count)
+        sizes.append(size)
+        file_sizes.append(file_size)
+        if on_rename:
+            on_rename(final_path)
+    
+    return shard_paths, checksums, counts, sizes, file_sizes
+
+def write_shard_index(split, shard_paths, counts, sizes, file_sizes):
+    """Write <split>.index (per-shard record count, serialized record bytes and
+    on-disk file bytes) so readers know the cardinality without scanning the
+    shards; returns its file name"""
+    index_name = f"{split}.index"
+    entries = [{'shard': shard, 'count': count, 'recordBytes': size, 'fileBytes': file_size}
+               for shard, count, size, file_size in zip(shard_paths, counts, sizes, file_sizes)]
+    with tf.io.gfile.GFile(os.path.join(OUTPUT_DIR, index_name), 'w') as f:
+        json.dump(entries, f, indent=2)
+    return index_name
+
+class ShardUploader:
+    """Uploads finished files to GCS_OUTPUT_URI on a thread pool, so network
+    I/O overlaps with the shards still being written"""
+    
+    def __init__(self, gcs_uri, workers=UPLOAD_WORKERS):
+        bucket_name, _, self.prefix = gcs_uri[len('gs://'):].partition('/')
+        self.bucket = get_storage_client().bucket(bucket_name)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+    
+    def __call__(self, local_path):
+        blob_name = '/'.join(p for p in [self.prefix.strip('/'), os.path.basename(local_path)] if p)
+        self.futures.append(self.pool.submit(self._upload, local_path, self.bucket.blob(blob_name)))
+    
+    def _upload(self, local_path, blob):
+        if os.path.getsize(local_path) < PARALLEL_UPLOAD_THRESHOLD:
+            blob.upload_from_filename(local_path)
+            return
+        # Large shard: upload its chunks in parallel and let GCS assemble them
+        from google.cloud.storage import transfer_manager
+        transfer_manager.upload_chunks_concurrently(
+            local_path, blob,
+            chunk_size=PARALLEL_UPLOAD_CHUNK_SIZE,
+            max_workers=4,
+            worker_type=transfer_manager.THREAD,
+        )
+    
+    def wait(self):
+        """Block until every submitted upload finishes, re-raising the first failure"""
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+    
+    def close(self):
+        self.pool.shutdown()
 
 def convert_dataset():
     """Main conversion function"""
@@ -195,24 +608,37 @@ def convert_dataset():
     print("TFRecord Converter - MLForge")
     print("=" * 60)
     
-    # Find dataset structure
-    print(f"\\nSearching for dataset in: {INPUT_DIR}")
-    folders = find_image_folder(INPUT_DIR)
-    
-    if not folders:
-        raise ValueError(f"Could not find valid image dataset in {INPUT_DIR}")
+    if GCS_OUTPUT_URI and OUTPUT_DIR.startswith('gs://'):
+        raise ValueError("GCS_OUTPUT_URI is only used with a local OUTPUT_DIR; "
+                         f"shards already go straight to {OUTPUT_DIR}")
     
-    train_dir = folders['train']
-    test_dir = folders.get('test')
+    # Find dataset structure
+    if INPUT_ZIP:
+        print(f"\\nIndexing ZIP archive: {INPUT_ZIP}")
+        zf = open_input_zip()
+        try:
+            layout = index_zip_images(zf)
+        finally:
+            close_zip(zf)
+        if not layout:
+            raise ValueError(f"Could not find valid image dataset in {INPUT_ZIP}")
+    else:
+        print(f"\\nSearching for dataset in: {INPUT_DIR}")
+        folders = find_image_folder(INPUT_DIR)
+        
+        if not folders:
+            raise ValueError(f"Could not find valid image dataset in {INPUT_DIR}")
+        
+        print(f"Found train folder: {folders['train']}")
+        if folders.get('test'):
+            print(f"Found test folder: {folders['test']}")
+        layout = index_folder_images(folders)
     
-    print(f"Found train folder: {train_dir}")
-    if test_dir:
-        print(f"Found test folder: {test_dir}")
+    train_layout = layout['train']
+    test_layout = layout['test']
     
     # Discover classes
-    class_names = sorted([d for d in os.listdir(train_dir) 
-                         if os.path.isdir(os.path.join(train_dir, d))
-                         and d not in ['__pycache__', '__MACOSX']])
+    class_names = sorted(train_layout)
     class_to_idx = {name: idx for idx, name in enumerate(class_names)}
     
     print(f"\\nFound {len(class_names)} classes:")
@@ -226,11 +652,10 @@ def convert_dataset():
     train_images = []
     sample_img = None
     for class_name in class_names:
-        class_dir = os.path.join(train_dir, class_name)
-        imgs = collect_images(class_dir, class_to_idx[class_name])
-        train_images.extend(imgs)
+        imgs = train_layout[class_name]
+        train_images.extend((img, class_to_idx[class_name]) for img in imgs)
         if sample_img is None and imgs:
-            sample_img = imgs[0][0]
+            sample_img = imgs[0]
     
     print(f"Total training images: {len(train_images)}")
     
@@ -243,7 +668,7 @@ def convert_dataset():
     random.shuffle(train_images)
     
     # Create train/val split if no separate test folder
-    if test_dir is None and VAL_SPLIT > 0:
+    if test_layout is None and VAL_SPLIT > 0:
         split_idx = int(len(train_images) * (1 - VAL_SPLIT))
         val_images = train_images[split_idx:]
         train_images = train_images[:split_idx]
@@ -253,71 +678,103 @@ def convert_dataset():
     
     # Collect test images if available
     test_images = []
-    if test_dir:
+    if test_layout:
         print("\\nCollecting test images...")
         for class_name in class_names:
-            class_dir = os.path.join(test_dir, class_name)
-            if os.path.exists(class_dir):
-                test_images.extend(collect_images(class_dir, class_to_idx[class_name]))
+            test_images.extend((img, class_to_idx[class_name]) for img in test_layout.get(class_name, []))
         print(f"Total test images: {len(test_images)}")
     
     # Create output directory
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    tf.io.gfile.makedirs(OUTPUT_DIR)
     
-    shard_size_bytes = SHARD_SIZE_MB * 1024 * 1024
+    shard_size_bytes = pick_shard_size(train_images)
+    uploader = ShardUploader(GCS_OUTPUT_URI) if GCS_OUTPUT_URI else None
     all_shard_paths = {'train': [], 'val': [], 'test': []}
     all_checksums = {}
+    shard_index = {}
+    sample_counts = {'train': 0, 'val': 0, 'test': 0}
     
     # Write training shards
-    print(f"\\nWriting training shards (~{SHARD_SIZE_MB}MB each)...")
-    train_shards, train_checksums = write_shards(
+    print(f"\\nWriting training shards (~{shard_size_bytes / (1024 * 1024):.0f}MB each)...")
+    train_shards, train_checksums, train_counts, train_sizes, train_file_sizes = write_shards(
         train_images, 
         os.path.join(OUTPUT_DIR, 'train'),
-        shard_size_bytes
+        shard_size_bytes,
+        uploader
     )
     all_shard_paths['train'] = train_shards
     all_checksums.update(train_checksums)
+    shard_index['train'] = write_shard_index('train', train_shards, train_counts, train_sizes, train_file_sizes)
+    sample_counts['train'] = sum(train_counts)
     
     # Write validation shards
     if val_images:
         print(f"\\nWriting validation shards...")
-        val_shards, val_checksums = write_shards(
+        val_shards, val_checksums, val_counts, val_sizes, val_file_sizes = write_shards(
             val_images,
             os.path.join(OUTPUT_DIR, 'val'),
-            shard_size_bytes
+            shard_size_bytes,
+            uploader
         )
         all_shard_paths['val'] = val_shards
         all_checksums.update(val_checksums)
+        shard_index['val'] = write_shard_index('val', val_shards, val_counts, val_sizes, val_file_sizes)
+        sample_counts['val'] = sum(val_counts)
     
     # Write test shards
     if test_images:
         print(f"\\nWriting test shards...")
-        test_shards, test_checksums = write_shards(
+        test_shards, test_checksums, test_counts, test_sizes, test_file_sizes = write_shards(
             test_images,
             os.path.join(OUTPUT_DIR, 'test'),
-            shard_size_bytes
+            shard_size_bytes,
+            uploader
         )
         all_shard_paths['test'] = test_shards
         all_checksums.update(test_checksums)
+        shard_index['test'] = write_shard_index('test', test_shards, test_counts, test_sizes, test_file_sizes)
+        sample_counts['test'] = sum(test_counts)
+    
+    # Every split is written; release the worker processes and input handles
+    close_shard_pool()
+    close_readers()
     
     # Create metadata
     metadata = {
         'numClasses': len(class_names),
         'classNames': class_names,
-        'trainSamples': len(train_images),
-        'valSamples': len(val_images) if val_images else None,
-        'testSamples': len(test_images) if test_images else None,
+        # Records actually written (images that failed to read are skipped)
+        'trainSamples': sample_counts['train'],
+        'valSamples': sample_counts['val'] if val_images else None,
+        'testSamples': sample_counts['test'] if test_images else None,
         'originalWidth': orig_width,
         'originalHeight': orig_height,
+        'shardSizeBytes': shard_size_bytes,
         'shardPaths': all_shard_paths,
+        'shardIndex': shard_index,
         'checksums': all_checksums,
+        'checksumAlgorithm': CHECKSUM_ALGORITHM,
+        'compression': COMPRESSION,
+        'includeFilenames': INCLUDE_FILENAMES,
         'createdAt': __import__('datetime').datetime.now().isoformat()
     }
     
     metadata_path = os.path.join(OUTPUT_DIR, 'metadata.json')
-    with open(metadata_path, 'w') as f:
+    with tf.io.gfile.GFile(metadata_path, 'w') as f:
         json.dump(metadata, f, indent=2)
     
+    if uploader:
+        print(f"\\nWaiting for uploads to {GCS_OUTPUT_URI}...")
+        try:
+            for index_name in shard_index.values():
+                uploader(os.path.join(OUTPUT_DIR, index_name))
+            uploader.wait()
+            # metadata.json goes last, once every shard and index is in place
+            uploader(metadata_path)
+            uploader.wait()
+        finally:
+            uploader.close()
+    
     print(f"\\n{'=' * 60}")
     print("Conversion Complete!")
     print(f"{'=' * 60}")
@@ -338,11 +795,24 @@ if __name__ == '__main__':
 
 /**
  * Generate a minimal requirements.txt for the Cloud Function
+ *
+ * By default uses pillow-simd, a drop-in Pillow fork with SSE4/AVX2 kernels. It
+ * installs under the same `PIL` package, so stock Pillow must not be installed
+ * alongside it. pillow-simd ships only as a source distribution, so the build
+ * image needs a C compiler, the Python headers and the libjpeg(-turbo) and zlib
+ * development headers (e.g. on Debian/Ubuntu: build-essential python3-dev
+ * libjpeg-turbo8-dev zlib1g-dev). Pass `{ simdPillow: false }` to fall back to
+ * the stock Pillow wheel when the build environment cannot compile it.
  */
-export function generateRequirements(): string {
+export function generateRequirements(options: { simdPillow?: boolean } = {}): string {
+    const { simdPillow = true } = options;
+    const pillow = simdPillow ? 'pillow-simd>=9.0.0' : 'Pillow>=9.0.0';
+
     return `tensorflow>=2.13.0
-Pillow>=9.0.0
-google-cloud-storage>=2.0.0
+${pillow}
+imagesize>=1.4.0
+zlib-ng>=0.4.0
+google-cloud-storage>=2.14.0
 google-cloud-firestore>=2.0.0
 `;
 }